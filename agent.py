@@ -1,18 +1,51 @@
 # agent.py
 from __future__ import annotations
 
-import json
+import ast
+import asyncio
+import hashlib
 import os
+import re
 import textwrap
-from typing import Any, Dict, List
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
-import requests
+import httpx
+import orjson
 
-from tools import list_files, read_file, search_files, ToolError, SearchHit
+try:
+    # 선택: 있으면 JSON 복구(salvage_json)에 사용
+    import json5
+except ImportError:
+    json5 = None
 
+try:
+    # 선택: AGENT_OLLAMA_NATIVE=1 일 때 ollama-python 클라이언트로 호출
+    import ollama
+except ImportError:
+    ollama = None
 
-OLLAMA_URL = "http://localhost:11434/api/chat"
+from tools import list_files, read_file, search_files, ToolError
+
+
+OLLAMA_HOST = "http://localhost:11434"
+OLLAMA_URL = f"{OLLAMA_HOST}/api/chat"
 MODEL = "qwen3:8b"
+# 옵션: 너무 길게 말하지 않게
+CHAT_OPTIONS = {"temperature": 0.2}
+
+# Ollama 연결을 턴마다 새로 맺지 않도록 keep-alive AsyncClient를 대화 내내 재사용 (_new_async_client)
+_CLIENT_TIMEOUT = httpx.Timeout(180.0, connect=10.0)
+_CLIENT_LIMITS = httpx.Limits(max_keepalive_connections=40, max_connections=100, keepalive_expiry=30)
+
+# AGENT_OLLAMA_NATIVE=1 이고 ollama 패키지가 있으면 raw HTTP 대신 공식 클라이언트 사용 (기본: raw HTTP)
+USE_NATIVE_CLIENT = os.environ.get("AGENT_OLLAMA_NATIVE") == "1" and ollama is not None
+
+# AGENT_CHAT_CACHE=1 이면 완전히 같은 대화(모델+메시지)에 대한 응답을 메모리에 캐시 (LRU)
+# 매번 다른 답을 원하면 끄면 됨 (기본: 꺼짐)
+CHAT_CACHE_ENABLED = os.environ.get("AGENT_CHAT_CACHE") == "1"
+_CHAT_CACHE: "OrderedDict[str, str]" = OrderedDict()
+_CHAT_CACHE_MAX = 256
 
 # 안전: 에이전트가 접근 가능한 루트 폴더 (원하는 경로로 바꾸세요)
 ROOT_DIR = os.path.abspath("data")
@@ -20,6 +53,12 @@ ROOT_DIR = os.path.abspath("data")
 # 에이전트가 호출 가능한 도구 목록 (allowlist)
 ALLOWED_TOOLS = {"list_files", "search_files", "read_file", "final"}
 
+# 관찰 결과 요약: 스니펫 한 줄 최대 길이 / read_file에서 이전 검색 hit 주변으로 남길 줄 수
+# read_file 결과는 READ_COLLAPSE_MIN_LINES줄을 넘을 때만 줄임 (짧은 파일은 그대로)
+SNIPPET_LINE_MAX_CHARS = 200
+READ_CONTEXT_LINES = 10
+READ_COLLAPSE_MIN_LINES = 300
+
 
 SYSTEM_PROMPT = f"""
 You are a careful file assistant running locally.
@@ -42,33 +81,397 @@ Rules:
 """
 
 
-def ollama_chat(messages: List[Dict[str, Any]]) -> str:
-    payload = {
+def _chat_payload(messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {
         "model": MODEL,
         "messages": messages,
-        "stream": False,
-        # 옵션: 너무 길게 말하지 않게
-        "options": {"temperature": 0.2},
+        "stream": True,
+        "options": CHAT_OPTIONS,
     }
-    r = requests.post(OLLAMA_URL, json=payload, timeout=180)
-    r.raise_for_status()
-    return r.json()["message"]["content"]
+
+
+def _chat_cache_key(messages: List[Dict[str, Any]]) -> str:
+    canonical = orjson.dumps({"m": MODEL, "msgs": messages}, option=orjson.OPT_SORT_KEYS)
+    return hashlib.sha256(canonical).hexdigest()
+
+
+def _chat_cache_get(key: str) -> Optional[str]:
+    content = _CHAT_CACHE.get(key)
+    if content is not None:
+        _CHAT_CACHE.move_to_end(key)
+    return content
+
+
+def _chat_cache_put(key: str, content: str) -> None:
+    _CHAT_CACHE[key] = content
+    _CHAT_CACHE.move_to_end(key)
+    if len(_CHAT_CACHE) > _CHAT_CACHE_MAX:
+        _CHAT_CACHE.popitem(last=False)
+
+
+class _ChatStream:
+    """
+    스트리밍 응답 조각을 모으면서, JSON 액션이 닫히는 순간을 감지.
+    feed()가 True를 돌려주면 나머지 생성은 기다리지 않고 연결을 끊어도 됨.
+    """
+
+    def __init__(self, on_token: Optional[Callable[[str], None]] = None):
+        self._parts: List[str] = []
+        self._on_token = on_token
+
+    @property
+    def content(self) -> str:
+        return "".join(self._parts)
+
+    def feed(self, piece: str) -> bool:
+        if not piece:
+            return False
+        self._parts.append(piece)
+        if self._on_token is not None:
+            try:
+                self._on_token(piece)
+            except Exception:
+                # 출력 콜백이 실패해도 응답 받기는 계속하고, 이후 조각은 콜백에 넘기지 않음
+                self._on_token = None
+        if "}" not in piece:
+            return False
+
+        buf = self.content
+        if buf.count("{") != buf.count("}"):
+            return False
+        try:
+            action = salvage_json(buf)
+        except ValueError:
+            return False
+        return "tool" in action
+
+
+def _stream_line_content(line: str) -> Tuple[str, bool]:
+    """Ollama NDJSON 한 줄 -> (content 조각, done 여부)."""
+    chunk = orjson.loads(line)
+    if "error" in chunk:
+        raise RuntimeError(f"Ollama error: {chunk['error']}")
+    return chunk.get("message", {}).get("content", ""), bool(chunk.get("done"))
+
+
+async def ollama_chat_async(
+    client: Any,
+    messages: List[Dict[str, Any]],
+    on_token: Optional[Callable[[str], None]] = None,
+) -> str:
+    """
+    client는 httpx.AsyncClient 또는 (USE_NATIVE_CLIENT일 때) ollama.AsyncClient.
+    stream=True로 받아서 조각마다 on_token을 부르고, JSON 액션이 완성되면 바로 응답을 끊음.
+    """
+    key = _chat_cache_key(messages) if CHAT_CACHE_ENABLED else None
+    if key is not None:
+        cached = _chat_cache_get(key)
+        if cached is not None:
+            # 콜백 호출은 스트리밍 때와 같은 경로로 (콜백 예외가 밖으로 나가지 않게)
+            _ChatStream(on_token).feed(cached)
+            return cached
+
+    stream = _ChatStream(on_token)
+    if isinstance(client, httpx.AsyncClient):
+        payload = _chat_payload(messages)
+        async with client.stream("POST", OLLAMA_URL, json=payload) as r:
+            r.raise_for_status()
+            async for line in r.aiter_lines():
+                if not line:
+                    continue
+                piece, done = _stream_line_content(line)
+                if stream.feed(piece) or done:
+                    # 응답을 다 읽지 않고 닫으면 연결이 끊겨서 Ollama도 생성을 멈춤
+                    break
+    else:
+        async for chunk in await client.chat(model=MODEL, messages=messages, options=CHAT_OPTIONS, stream=True):
+            if stream.feed(chunk["message"]["content"]) or chunk.get("done"):
+                break
+
+    content = stream.content
+    if key is not None:
+        _chat_cache_put(key, content)
+    return content
+
+
+class FinalAnswerStream:
+    """
+    스트리밍 중인 JSON 조각에서 {"tool": "final", "args": {"answer": "..."}}의 answer 문자열만
+    골라 디코딩해서 도착하는 대로 on_text로 넘김. tool 호출 턴이면 아무것도 넘기지 않음.
+    턴마다 새로 만들어서 씀.
+    """
+
+    _ANSWER_START_RE = re.compile(r'"tool"\s*:\s*"final".*?"answer"\s*:\s*"', re.DOTALL)
+    _HEX4_RE = re.compile(r"[0-9a-fA-F]{4}")
+    _ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f", '"': '"', "\\": "\\", "/": "/"}
+
+    def __init__(self, on_text: Callable[[str], None]):
+        self._on_text = on_text
+        self._buf = ""
+        self._pos: Optional[int] = None
+        self._done = False
+
+    def feed(self, piece: str) -> None:
+        self._buf += piece
+        if self._done:
+            return
+        if self._pos is None:
+            m = self._ANSWER_START_RE.search(self._buf)
+            if m is None:
+                return
+            self._pos = m.end()
+
+        buf = self._buf
+        i = self._pos
+        out: List[str] = []
+        while i < len(buf):
+            c = buf[i]
+            if c == '"':
+                self._done = True
+                break
+            if c != "\\":
+                out.append(c)
+                i += 1
+                continue
+            # 이스케이프: 뒷부분이 아직 안 왔으면 다음 조각까지 기다림
+            if i + 1 >= len(buf):
+                break
+            esc = buf[i + 1]
+            if esc != "u":
+                out.append(self._ESCAPES.get(esc, esc))
+                i += 2
+                continue
+            if i + 6 > len(buf):
+                break
+            code = self._hex4(buf[i + 2 : i + 6])
+            if 0xD800 <= code < 0xDC00:
+                # 서로게이트 쌍은 뒤쪽 \uXXXX까지 와야 디코딩 가능
+                if i + 12 > len(buf):
+                    break
+                low = self._hex4(buf[i + 8 : i + 12]) if buf[i + 6 : i + 8] == "\\u" else -1
+                if 0xDC00 <= low < 0xE000:
+                    out.append(chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)))
+                    i += 12
+                    continue
+                code = -1
+            if code < 0 or 0xDC00 <= code < 0xE000:
+                # 잘못된 \u 이스케이프 (예: 답변 속 Windows 경로 "C:\users"): 여기서 스트리밍을 멈추고
+                # 나머지는 최종 JSON 파싱(실패하면 재시도 턴)에 맡김
+                self._done = True
+                break
+            out.append(chr(code))
+            i += 6
+
+        self._pos = i
+        if out:
+            self._on_text("".join(out))
+
+    @classmethod
+    def _hex4(cls, s: str) -> int:
+        """4자리 16진수면 그 값, 아니면 -1."""
+        return int(s, 16) if cls._HEX4_RE.fullmatch(s) else -1
+
+
+def _extract_json_object(s: str) -> str:
+    """
+    첫 '{'부터 짝이 맞는 '}'까지 한 번 훑어서 잘라냄 (문자열 안의 괄호/이스케이프는 무시).
+    '{'가 없으면 그대로, 닫히지 않았으면 '{'부터 끝까지 반환.
+    """
+    start = s.find("{")
+    if start == -1:
+        return s
+
+    depth = 0
+    in_str = False
+    escape = False
+    for i in range(start, len(s)):
+        c = s[i]
+        if in_str:
+            if escape:
+                escape = False
+            elif c == "\\":
+                escape = True
+            elif c == '"':
+                in_str = False
+        elif c == '"':
+            in_str = True
+        elif c == "{":
+            depth += 1
+        elif c == "}":
+            depth -= 1
+            if depth == 0:
+                return s[start : i + 1]
+    return s[start:]
+
+
+class OllamaBatcher:
+    """
+    짧은 구간(window) 안에 들어온 chat 요청을 모아서 한꺼번에 동시 전송하는 마이크로배처.
+    Ollama는 HTTP 요청끼리 묶어서 처리하지 않으므로, 모은 요청을 같은 AsyncClient 커넥션 풀로
+    병렬로 보내서 서버의 병렬 슬롯을 채우는 방식. 동시에 나가는 요청은 max_batch개로 제한.
+    Ollama 쪽도 OLLAMA_NUM_PARALLEL=8 (max_batch와 같게) 정도로 맞춰야 실제로 병렬 처리됨.
+    """
+
+    def __init__(self, client: Any, max_batch: int = 8, window: float = 0.01):
+        self._client = client
+        self._max_batch = max_batch
+        self._window = window
+        self._queue: "asyncio.Queue[Tuple[List[Dict[str, Any]], Optional[Callable[[str], None]], asyncio.Future]]" = (
+            asyncio.Queue()
+        )
+        self._slots = asyncio.Semaphore(max_batch)
+        self._worker: Optional[asyncio.Task] = None
+        # 진행 중인 전송 태스크 (참조를 들고 있어야 도중에 GC되지 않고, aclose에서 정리 가능)
+        self._sends: Set[asyncio.Task] = set()
+
+    async def chat(
+        self,
+        messages: List[Dict[str, Any]],
+        on_token: Optional[Callable[[str], None]] = None,
+    ) -> str:
+        fut = asyncio.get_running_loop().create_future()
+        await self._queue.put((messages, on_token, fut))
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+        return await fut
+
+    async def aclose(self) -> None:
+        """
+        worker와 진행 중인 전송을 모두 취소하고 끝날 때까지 기다림 (클라이언트를 닫기 전에 호출).
+        아직 보내지 못한 요청은 취소됨.
+        """
+        tasks = list(self._sends)
+        if self._worker is not None:
+            tasks.append(self._worker)
+            self._worker = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        while not self._queue.empty():
+            _, _, fut = self._queue.get_nowait()
+            fut.cancel()
+
+    async def _run(self) -> None:
+        batch: List[Tuple[List[Dict[str, Any]], Optional[Callable[[str], None]], asyncio.Future]] = []
+        try:
+            while True:
+                batch = [await self._queue.get()]
+                # window 동안 더 들어오는 요청을 모아서 같이 보냄
+                await asyncio.sleep(self._window)
+                while len(batch) < self._max_batch and not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                while batch:
+                    await self._slots.acquire()
+                    messages, on_token, fut = batch.pop(0)
+                    task = asyncio.create_task(self._send(messages, on_token, fut))
+                    self._sends.add(task)
+                    task.add_done_callback(self._sends.discard)
+        finally:
+            # 취소됐을 때 꺼내 놓고 못 보낸 요청은 기다리는 쪽이 멈추지 않게 취소
+            for _, _, fut in batch:
+                fut.cancel()
+
+    async def _send(
+        self,
+        messages: List[Dict[str, Any]],
+        on_token: Optional[Callable[[str], None]],
+        fut: asyncio.Future,
+    ) -> None:
+        try:
+            content = await ollama_chat_async(self._client, messages, on_token)
+        except Exception as e:
+            if not fut.done():
+                fut.set_exception(e)
+        else:
+            if not fut.done():
+                fut.set_result(content)
+        finally:
+            # 전송이 취소됐으면 기다리는 쪽도 같이 취소
+            if not fut.done():
+                fut.cancel()
+            self._slots.release()
 
 
 def parse_json_strict(s: str) -> Dict[str, Any]:
     """
     모델이 가끔 앞뒤로 텍스트를 섞을 수 있어 방어적으로 JSON만 추출.
-    그래도 실패하면 그대로 에러.
+    그래도 실패하거나 JSON 객체(dict)가 아니면 에러.
     """
-    s = s.strip()
-    # JSON 객체 시작/끝을 찾아보기
-    if not s.startswith("{"):
-        first = s.find("{")
-        last = s.rfind("}")
-        if first != -1 and last != -1 and last > first:
-            s = s[first : last + 1]
+    action = orjson.loads(_extract_json_object(s))
+    if not isinstance(action, dict):
+        raise ValueError(f"expected a JSON object, got {type(action).__name__}")
+    return action
 
-    return json.loads(s)
+
+_CODE_FENCE_RE = re.compile(r"^```[A-Za-z0-9_-]*\s*|\s*```$")
+_SMART_QUOTES = str.maketrans({"\u201c": '"', "\u201d": '"', "\u2018": "'", "\u2019": "'"})
+
+
+def _strip_trailing_commas(s: str) -> str:
+    """
+    문자열 밖에서 } 또는 ] 바로 앞(공백 무시)에 오는 쉼표만 지움. 문자열 내용은 건드리지 않음.
+    """
+    out: List[str] = []
+    in_str = False
+    escape = False
+    for i, c in enumerate(s):
+        if in_str:
+            if escape:
+                escape = False
+            elif c == "\\":
+                escape = True
+            elif c == '"':
+                in_str = False
+        elif c == '"':
+            in_str = True
+        elif c == ",":
+            j = i + 1
+            while j < len(s) and s[j].isspace():
+                j += 1
+            if j < len(s) and s[j] in "}]":
+                continue
+        out.append(c)
+    return "".join(out)
+
+
+def _salvage_once(s: str) -> Optional[Dict[str, Any]]:
+    obj = _extract_json_object(s)
+    parsers = [
+        lambda: orjson.loads(s),
+        lambda: orjson.loads(obj),
+        lambda: orjson.loads(_strip_trailing_commas(obj)),
+    ]
+    if json5 is not None:
+        parsers.append(lambda: json5.loads(obj))
+    # 작은따옴표 dict 같은 파이썬 리터럴 형태 (true/false/null은 못 읽음, trailing comma는 허용)
+    parsers.append(lambda: ast.literal_eval(obj))
+
+    for parse in parsers:
+        try:
+            action = parse()
+        except Exception:
+            continue
+        if isinstance(action, dict):
+            return action
+    return None
+
+
+def salvage_json(s: str) -> Dict[str, Any]:
+    """
+    parse_json_strict가 실패했을 때, LLM을 다시 부르기 전에 로컬에서 JSON 복구를 시도.
+    코드펜스(```json ... ```), trailing comma, 작은따옴표 dict, 스마트 따옴표 등을 허용.
+    스마트 따옴표는 답변 본문에도 흔히 들어가므로 원문 그대로 전부 실패했을 때만 바꿔서 다시 시도.
+    전부 실패하면 ValueError.
+    """
+    s = _CODE_FENCE_RE.sub("", s.strip())
+    action = _salvage_once(s)
+    if action is None:
+        translated = s.translate(_SMART_QUOTES)
+        if translated != s:
+            action = _salvage_once(translated)
+    if action is None:
+        raise ValueError("could not salvage JSON from model output")
+    return action
 
 
 def tool_to_observation(result: Any) -> str:
@@ -76,22 +479,106 @@ def tool_to_observation(result: Any) -> str:
     tool 실행 결과를 LLM에 '관찰(observation)'로 전달하기 위한 문자열 변환.
     """
     if isinstance(result, list):
-        # SearchHit list인 경우 보기 좋게
-        if result and isinstance(result[0], SearchHit):
+        # search_files 결과(파일별로 묶인 hit)인 경우: 파일마다 경로는 한 번만
+        if result and isinstance(result[0], dict) and "hits" in result[0]:
             lines = []
-            for idx, hit in enumerate(result, start=1):
-                lines.append(f"[HIT {idx}] path={hit.path}")
-                lines.append(hit.line)
-                lines.append("")
+            for idx, group in enumerate(result, start=1):
+                lines.append(f"[FILE {idx}] path={group['path']}")
+                for hit in group["hits"]:
+                    lines.append(textwrap.indent(hit["snippet"], "  "))
+                    lines.append("")
             return "\n".join(lines).strip()
 
         # 일반 리스트
-        return json.dumps(result, ensure_ascii=False, indent=2)
+        return orjson.dumps(result, option=orjson.OPT_INDENT_2).decode()
 
     if isinstance(result, str):
         return result
 
-    return json.dumps(result, ensure_ascii=False, indent=2)
+    return orjson.dumps(result, option=orjson.OPT_INDENT_2).decode()
+
+
+def _observation_key(path: str) -> str:
+    # search_files는 절대경로, read_file은 상대경로로 올 수 있어서 같은 키로 맞춤
+    return os.path.realpath(os.path.join(ROOT_DIR, path))
+
+
+def _shorten_line(line: str) -> str:
+    if len(line) <= SNIPPET_LINE_MAX_CHARS:
+        return line
+    return line[:SNIPPET_LINE_MAX_CHARS] + "…"
+
+
+def _collapse_read(text: str, hit_lines: List[int]) -> str:
+    """
+    read_file 결과에서 이전 검색 hit 주변(±READ_CONTEXT_LINES)만 줄 번호와 함께 남김.
+    줄 번호는 search_files와 같은 splitlines() 기준. READ_COLLAPSE_MIN_LINES줄 이하면 그대로 반환.
+    """
+    truncated = text.endswith("\n\n...[TRUNCATED]...")
+    lines = text.splitlines()
+    if truncated:
+        lines = lines[:-2]
+    if len(lines) <= READ_COLLAPSE_MIN_LINES:
+        return text
+
+    keep = set()
+    for ln in hit_lines:
+        keep.update(range(max(1, ln - READ_CONTEXT_LINES), min(len(lines), ln + READ_CONTEXT_LINES) + 1))
+    if not keep:
+        return text
+
+    out = [
+        f"(showing lines near earlier search hits; file has {len(lines)}{'+' if truncated else ''} lines. "
+        'Call read_file again with "full": true to get the whole text.)'
+    ]
+    prev = 0
+    for ln in sorted(keep):
+        if ln != prev + 1:
+            out.append("   ...")
+        out.append(f"{ln:>4}: {lines[ln - 1]}")
+        prev = ln
+    if prev < len(lines) or truncated:
+        out.append("   ...")
+    return "\n".join(out)
+
+
+def summarize_observation(
+    tool: str,
+    args: Dict[str, Any],
+    result: Any,
+    seen_hits: Dict[str, List[int]],
+) -> str:
+    """
+    tool 결과를 그대로 넘기지 않고, 답에 필요한 근거만 남겨서 관찰 문자열로 만듦.
+    - search_files: 경로는 ROOT_DIR 기준 상대경로로, 스니펫 줄은 길이 제한.
+      찾은 줄 번호는 seen_hits에 기록해 둠
+    - read_file: 긴 파일이고 같은 파일에서 검색으로 찾은 줄이 있으면 그 주변만 남김
+      (args에 "full": true가 있으면 줄이지 않음)
+    - 그 외: tool_to_observation 그대로
+    """
+    if tool == "search_files":
+        short = []
+        for group in result:
+            seen_hits.setdefault(_observation_key(group["path"]), []).extend(h["line_no"] for h in group["hits"])
+            path = os.path.relpath(group["path"], ROOT_DIR)
+            if path.startswith(".."):
+                path = group["path"]
+            hits = [
+                {
+                    "line_no": h["line_no"],
+                    "snippet": "\n".join(_shorten_line(line) for line in h["snippet"].split("\n")),
+                }
+                for h in group["hits"]
+            ]
+            short.append({"path": path, "hits": hits})
+        return tool_to_observation(short)
+
+    if tool == "read_file" and not bool(args.get("full", False)):
+        hit_lines = seen_hits.get(_observation_key(str(args.get("path", "")).strip()))
+        if hit_lines:
+            return _collapse_read(result, hit_lines)
+
+    return tool_to_observation(result)
 
 
 def run_tool(tool: str, args: Dict[str, Any]) -> Any:
@@ -126,29 +613,48 @@ def run_tool(tool: str, args: Dict[str, Any]) -> Any:
     raise ToolError(f"Unknown tool: {tool}")
 
 
-def agent(question: str, max_steps: int = 6) -> Dict[str, Any]:
+async def agent(
+    batcher: OllamaBatcher,
+    question: str,
+    max_steps: int = 6,
+    on_answer_text: Optional[Callable[[str], None]] = None,
+) -> Dict[str, Any]:
+    """
+    on_answer_text를 주면 final 답변 텍스트를 생성되는 대로 조각 단위로 넘겨줌.
+    """
     messages: List[Dict[str, Any]] = [
         {"role": "system", "content": SYSTEM_PROMPT.strip()},
         {"role": "user", "content": question},
     ]
 
+    # 검색에서 찾은 줄 번호 (파일별) - read_file 결과를 줄일 때 씀
+    seen_hits: Dict[str, List[int]] = {}
+
     for step in range(1, max_steps + 1):
-        raw = ollama_chat(messages)
+        on_token = FinalAnswerStream(on_answer_text).feed if on_answer_text is not None else None
+        raw = await batcher.chat(messages, on_token)
 
+        action: Optional[Dict[str, Any]] = None
+        error = ""
         try:
             action = parse_json_strict(raw)
         except Exception as e:
+            error = str(e)
+            # 로컬에서 고칠 수 있으면 LLM 재호출 없이 그대로 진행
+            try:
+                action = salvage_json(raw)
+            except Exception:
+                pass
+
+        if action is None:
             # 모델이 JSON 규칙을 어겼을 때: 규칙을 재강조하고 재시도
-            messages.append(
-                {
-                    "role": "assistant",
-                    "content": '{"tool":"search_files","args":{"query":"(rule reminder) output JSON only"}}',
-                }
-            )
+            # 이전 메시지는 건드리지 않고 덧붙이기만 해서 Ollama의 프롬프트(KV) 캐시를 살림
+            # 모델이 자기 출력을 볼 수 있게 raw를 그대로 assistant로 넣고, 그 뒤에 교정 요청
+            messages.append({"role": "assistant", "content": raw})
             messages.append(
                 {
                     "role": "user",
-                    "content": f"Your last output was not valid JSON. Error={e}. Output ONLY JSON per the schema.",
+                    "content": f"Your last output was not valid JSON. Error={error}. Output ONLY JSON per the schema.",
                 }
             )
             continue
@@ -159,15 +665,16 @@ def agent(question: str, max_steps: int = 6) -> Dict[str, Any]:
         if tool == "final":
             return action
 
-        # tool 실행
+        # tool 실행 (파일 I/O는 스레드로 넘겨서 다른 질문의 대기를 막지 않게)
         try:
-            result = run_tool(tool, args)
-            obs = tool_to_observation(result)
+            result = await asyncio.to_thread(run_tool, tool, args)
+            obs = summarize_observation(tool, args, result, seen_hits)
         except Exception as e:
             obs = f"TOOL_ERROR: {type(e).__name__}: {e}"
 
         # 관찰 결과를 메시지에 추가
-        messages.append({"role": "assistant", "content": json.dumps(action, ensure_ascii=False)})
+        # assistant 메시지는 모델이 실제로 생성한 raw 그대로 넣어야 다음 턴에서 앞부분이 캐시에 맞음
+        messages.append({"role": "assistant", "content": raw})
         messages.append(
             {
                 "role": "user",
@@ -185,22 +692,125 @@ def agent(question: str, max_steps: int = 6) -> Dict[str, Any]:
     }
 
 
+def _new_async_client() -> Any:
+    """
+    USE_NATIVE_CLIENT면 ollama.AsyncClient, 아니면 keep-alive httpx.AsyncClient.
+    이벤트 루프에 묶이므로 그 루프 안에서 계속 재사용.
+    """
+    if USE_NATIVE_CLIENT:
+        return ollama.AsyncClient(host=OLLAMA_HOST, timeout=_CLIENT_TIMEOUT, limits=_CLIENT_LIMITS)
+    return httpx.AsyncClient(timeout=_CLIENT_TIMEOUT, limits=_CLIENT_LIMITS)
+
+
+async def _close_client(client: Any) -> None:
+    if isinstance(client, httpx.AsyncClient):
+        await client.aclose()
+    else:
+        # ollama.AsyncClient.close()가 내부 httpx 커넥션 풀을 닫음
+        await client.close()
+
+
+async def batch_agent(
+    questions: List[str],
+    max_steps: int = 6,
+    on_answer_text: Optional[Callable[[str], None]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    여러 질문을 하나의 AsyncClient + OllamaBatcher로 동시에 처리 (스크립트/배치용).
+    결과 순서는 questions 순서와 같음. on_answer_text는 모든 질문에 같이 쓰이므로
+    질문이 여러 개면 조각이 섞일 수 있음 (대화형 한 질문용).
+    한 질문이 예외로 실패해도 나머지 결과는 그대로 돌려주고, 실패한 질문 자리에는
+    오류 내용을 answer로 담고 "error" 키가 붙은 final을 넣음.
+    """
+    client = _new_async_client()
+    try:
+        return await _run_batch(client, questions, max_steps, on_answer_text)
+    finally:
+        await _close_client(client)
+
+
+async def _run_batch(
+    client: Any,
+    questions: List[str],
+    max_steps: int,
+    on_answer_text: Optional[Callable[[str], None]],
+) -> List[Dict[str, Any]]:
+    batcher = OllamaBatcher(client)
+    try:
+        results = await asyncio.gather(
+            *(agent(batcher, q, max_steps=max_steps, on_answer_text=on_answer_text) for q in questions),
+            return_exceptions=True,
+        )
+    finally:
+        await batcher.aclose()
+
+    outs: List[Dict[str, Any]] = []
+    for r in results:
+        if isinstance(r, Exception):
+            outs.append(_failed_final(r))
+        elif isinstance(r, BaseException):
+            # 취소/KeyboardInterrupt 등은 그대로 올림
+            raise r
+        else:
+            outs.append(r)
+    return outs
+
+
+def _failed_final(e: Exception) -> Dict[str, Any]:
+    error = f"{type(e).__name__}: {e}"
+    return {
+        "tool": "final",
+        "args": {"answer": f"질문을 처리하다가 오류가 났어: {error}", "citations": []},
+        "error": error,
+    }
+
+
 def main():
     print(f"ROOT_DIR = {ROOT_DIR}")
     print("Type a question. Ctrl+C to exit.\n")
 
-    while True:
-        q = input("Q> ").strip()
-        if not q:
-            continue
-        out = agent(q, max_steps=6)
-        print("\n--- ANSWER ---")
-        print(out["args"]["answer"])
-        if out["args"].get("citations"):
-            print("\n--- CITATIONS ---")
-            for c in out["args"]["citations"]:
-                print("-", c)
-        print("--------------\n")
+    # 질문마다 이벤트 루프와 클라이언트를 새로 만들지 않도록, 루프 하나에서 같은 AsyncClient+배처를 계속 씀
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    client = _new_async_client()
+    batcher = OllamaBatcher(client)
+    try:
+        while True:
+            q = input("Q> ").strip()
+            if not q:
+                continue
+            # final 답변은 생성되는 대로 바로 출력
+            streamed: List[str] = []
+
+            def on_answer_text(text: str) -> None:
+                if not streamed:
+                    print("\n--- ANSWER ---")
+                streamed.append(text)
+                print(text, end="", flush=True)
+
+            out = loop.run_until_complete(agent(batcher, q, max_steps=6, on_answer_text=on_answer_text))
+            answer = out["args"]["answer"]
+            if streamed:
+                print()
+            # 스트리밍된 텍스트가 최종 답과 다르면 (파싱에 실패한 턴의 초안이 섞였거나, 최대 단계에 도달했거나)
+            # 채택된 답을 다시 출력
+            if "".join(streamed) != answer:
+                print("\n--- ANSWER ---")
+                print(answer)
+            if out["args"].get("citations"):
+                print("\n--- CITATIONS ---")
+                for c in out["args"]["citations"]:
+                    print("-", c)
+            print("--------------\n")
+    finally:
+        # Ctrl+C로 끝나도 남은 작업을 정리하고 커넥션을 닫음
+        pending = asyncio.all_tasks(loop)
+        for task in pending:
+            task.cancel()
+        loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        loop.run_until_complete(batcher.aclose())
+        loop.run_until_complete(_close_client(client))
+        loop.close()
 
 
 if __name__ == "__main__":
@@ -2,56 +2,35 @@
 from __future__ import annotations
 
 import os
-import re
 from pathlib import Path
 from typing import List, Dict, Any
 
 from mcp.server.fastmcp import FastMCP
 
+# 파일 읽기/검색 로직은 tools.py와 공유 (여기는 ROOT_DIR 바인딩과 MCP 래퍼만)
+import tools
+from tools import ALLOWED_EXTS, ToolError, _read_prefix
+
 # -----------------------
 # 설정: 여기만 바꾸면 됨
 # -----------------------
 ROOT_DIR = os.path.abspath("data")
-ALLOWED_EXTS = {".txt", ".md", ".py", ".json", ".yaml", ".yml", ".log"}
-
-mcp = FastMCP("LocalFileTools")
 
+# ROOT_DIR의 실제 경로는 시작할 때 한 번만 계산
+_ROOT_RESOLVED = os.path.realpath(os.path.expanduser(ROOT_DIR))
 
-class ToolError(Exception):
-    pass
+mcp = FastMCP("LocalFileTools")
 
 
 def _resolve_under_root(path: str) -> Path:
-    root = Path(ROOT_DIR).resolve()
-    p = Path(path).expanduser()
-    if not p.is_absolute():
-        p = (root / p).resolve()
-    else:
-        p = p.resolve()
-
-    # root 밖으로 나가면 차단
-    try:
-        p.relative_to(root)
-    except ValueError:
-        raise ToolError(f"Access denied (outside ROOT_DIR): {p}")
-    return p
-
-
-def _iter_files(max_files: int = 500):
-    root = Path(ROOT_DIR).resolve()
-    count = 0
-    for p in root.rglob("*"):
-        if p.is_file() and p.suffix.lower() in ALLOWED_EXTS:
-            yield p
-            count += 1
-            if count >= max_files:
-                return
+    # root 밖으로 나가면 차단 (검사 로직은 tools와 공유, root는 시작할 때 계산한 값 사용)
+    return tools._resolve_under_root(_ROOT_RESOLVED, path)
 
 
 @mcp.tool()
 def list_files(max_files: int = 200) -> List[str]:
     """List files under ROOT_DIR (allowed extensions only)."""
-    return [str(p) for p in _iter_files(max_files=max_files)]
+    return tools.list_files(_ROOT_RESOLVED, max_files=max_files)
 
 
 @mcp.tool()
@@ -63,10 +42,7 @@ def read_file(path: str, max_chars: int = 12000) -> str:
     if not p.exists() or not p.is_file():
         raise ToolError(f"File not found: {p}")
 
-    text = p.read_text(encoding="utf-8", errors="replace")
-    if len(text) > max_chars:
-        return text[:max_chars] + "\n\n...[TRUNCATED]..."
-    return text
+    return _read_prefix(p, max_chars)
 
 
 @mcp.tool()
@@ -78,50 +54,19 @@ def search_files(
 ) -> List[Dict[str, Any]]:
     """
     Search for a substring (or regex if query is /pattern/) in files under ROOT_DIR.
-    Returns hits with file path and line snippets.
+    Returns hits grouped by file: [{"path": ..., "hits": [{"line_no": ..., "snippet": ...}]}].
     """
     if not query or not query.strip():
         raise ToolError("query must be non-empty")
 
-    regex_mode = len(query) >= 2 and query.startswith("/") and query.endswith("/")
-    pattern = query[1:-1] if regex_mode else query
-
-    flags = 0 if case_sensitive else re.IGNORECASE
-    compiled = re.compile(pattern, flags) if regex_mode else None
-
-    hits: List[Dict[str, Any]] = []
-
-    for p in _iter_files(max_files=1000):
-        try:
-            lines = p.read_text(encoding="utf-8", errors="replace").splitlines()
-        except Exception:
-            continue
-
-        for i, line in enumerate(lines, start=1):
-            matched = False
-            if regex_mode:
-                matched = compiled.search(line) is not None  # type: ignore
-            else:
-                matched = (pattern in line) if case_sensitive else (pattern.lower() in line.lower())
-
-            if matched:
-                start = max(1, i - context_lines)
-                end = min(len(lines), i + context_lines)
-                snippet = []
-                for ln in range(start, end + 1):
-                    prefix = ">" if ln == i else " "
-                    snippet.append(f"{prefix}{ln:>4}: {lines[ln-1]}")
-                hits.append(
-                    {
-                        "path": str(p),
-                        "line_no": i,
-                        "snippet": "\n".join(snippet),
-                    }
-                )
-                if len(hits) >= max_hits:
-                    return hits
-
-    return hits
+    return tools.search_files(
+        _ROOT_RESOLVED,
+        query,
+        max_hits=max_hits,
+        context_lines=context_lines,
+        case_sensitive=case_sensitive,
+        max_files=1000,
+    )
 
 
 if __name__ == "__main__":
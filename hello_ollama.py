@@ -8,6 +8,17 @@ payload = {
     "stream": False
 }
 
-r = requests.post("http://localhost:11434/api/chat", json=payload, timeout=120)
+session = requests.Session()
+session.mount(
+    "http://",
+    requests.adapters.HTTPAdapter(pool_connections=10, pool_maxsize=10, max_retries=0),
+)
+
+r = session.post(
+    "http://localhost:11434/api/chat",
+    json=payload,
+    timeout=120,
+    headers={"Connection": "keep-alive", "Accept-Encoding": "gzip"},
+)
 r.raise_for_status()
 print(r.json()["message"]["content"])
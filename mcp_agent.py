@@ -6,13 +6,19 @@ import json
 import os
 from typing import Any, Dict, List
 
-import requests
+import httpx
 from mcp import ClientSession, StdioServerParameters, types
 from mcp.client.stdio import stdio_client
 
 OLLAMA_URL = "http://localhost:11434/api/chat"
 MODEL = "qwen3:8b"
 
+# Ollama 연결을 턴마다 새로 맺지 않도록 keep-alive 클라이언트를 재사용
+_CLIENT = httpx.Client(
+    timeout=httpx.Timeout(180.0, connect=10.0),
+    limits=httpx.Limits(max_keepalive_connections=40, max_connections=100, keepalive_expiry=30),
+)
+
 
 def ollama_chat(messages: List[Dict[str, Any]]) -> str:
     payload = {
@@ -21,9 +27,7 @@ def ollama_chat(messages: List[Dict[str, Any]]) -> str:
         "stream": False,
         "options": {"temperature": 0.2},
     }
-    r = requests.post(OLLAMA_URL, json=payload, timeout=180)
-    r.raise_for_status()
-    return r.json()["message"]["content"]
+    return _CLIENT.post(OLLAMA_URL, json=payload).raise_for_status().json()["message"]["content"]
 
 
 def parse_json_action(s: str) -> Dict[str, Any]:
@@ -143,7 +147,8 @@ Rules:
                         obs_text = f"TOOL_ERROR: {type(e).__name__}: {e}"
 
                     # 다음 턴에 관찰 결과를 넣어줌
-                    messages.append({"role": "assistant", "content": json.dumps(action, ensure_ascii=False)})
+                    # 모델이 생성한 raw 그대로 넣어야 다음 턴에서 Ollama 프롬프트 캐시가 맞음
+                    messages.append({"role": "assistant", "content": raw})
                     messages.append({"role": "user", "content": "Observation:\n" + obs_text})
                 else:
                     print("Max steps reached. Try a narrower question.\n")
@@ -1,15 +1,41 @@
 # tools.py
 from __future__ import annotations
 
+import codecs
+import functools
+import mmap
 import os
 import re
+import shutil
+import subprocess
+import threading
+import time
+from bisect import bisect_right
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Iterable, List, Tuple, Optional
+from typing import Any, Dict, FrozenSet, Iterable, List, Tuple, Optional
 
 
 ALLOWED_EXTS = {".txt", ".md", ".py", ".json", ".yaml", ".yml", ".log"}
 
+# 한 대화 안에서 같은 파일을 반복해서 읽지 않도록 캐시
+# path -> (mtime_ns, size, text, 각 줄의 시작 오프셋)
+# 개수(_FILE_CACHE_MAX)와 텍스트 총 글자 수(_FILE_CACHE_MAX_CHARS) 둘 다 넘지 않게 유지
+_FILE_CACHE: Dict[str, Tuple[int, int, str, List[int]]] = {}
+_FILE_CACHE_MAX = 512
+_FILE_CACHE_MAX_CHARS = 64_000_000
+_file_cache_chars = 0
+
+# agent가 여러 질문의 도구 호출을 스레드로 동시에 돌리므로 캐시 갱신(삭제+추가)은 락으로 보호
+_CACHE_LOCK = threading.Lock()
+
+# root -> (root mtime_ns, 캐시 시각, 파일 목록). 하위 폴더 변경은 mtime에 안 잡혀서 TTL도 같이 씀
+_LIST_CACHE: Dict[str, Tuple[int, float, List[str]]] = {}
+_LIST_CACHE_TTL = 5.0
+
+# ripgrep이 설치돼 있으면 문자열 포함 검색은 rg에 맡김 (없으면 파이썬 스캔)
+_RG = shutil.which("rg")
+
 
 @dataclass
 class SearchHit:
@@ -22,43 +48,339 @@ class ToolError(Exception):
     pass
 
 
+@functools.lru_cache(maxsize=32)
+def _resolved_root(root_dir: str) -> str:
+    """root_dir의 실제 경로 (심볼릭 링크 해석). root마다 한 번만 계산."""
+    return os.path.realpath(os.path.expanduser(root_dir))
+
+
 def _resolve_under_root(root_dir: str, target_path: str) -> Path:
     """
     root_dir 밖으로 나가는 경로 접근(../)을 막기 위한 안전장치.
+    대상 경로는 호출마다 realpath로 다시 확인함 (중간 폴더가 나중에 심볼릭 링크로 바뀔 수 있어서 캐시하지 않음).
     """
-    root = Path(root_dir).expanduser().resolve()
-    target = Path(target_path).expanduser()
+    root = _resolved_root(root_dir)
+    target = os.path.expanduser(target_path)
 
     # 상대경로면 root 기준으로 붙임
-    if not target.is_absolute():
-        target = (root / target).resolve()
-    else:
-        target = target.resolve()
+    if not os.path.isabs(target):
+        target = os.path.join(root, target)
+    target = os.path.realpath(target)
 
-    try:
-        target.relative_to(root)
-    except ValueError:
+    prefix = root if root.endswith(os.sep) else root + os.sep
+    if target != root and not target.startswith(prefix):
         raise ToolError(f"Access denied: path is outside root_dir. path={target}")
 
-    return target
+    return Path(target)
+
+
+# str.splitlines()가 줄 경계로 보는 문자 (\r, \r\n은 텍스트 모드로 읽을 때 이미 \n으로 바뀜)
+_LINE_SEPS = "\n\v\f\x1c\x1d\x1e\x85\u2028\u2029"
+_LINE_SEP_RE = re.compile(f"[{re.escape(_LINE_SEPS)}]")
+
+
+def _get_text(path: str) -> Tuple[str, List[int]]:
+    """
+    파일 전체 텍스트와 각 줄의 시작 오프셋을 반환. mtime/size가 그대로면 캐시를 재사용.
+    줄 구분은 splitlines()와 같게 맞춤 (마지막 개행 뒤 빈 줄은 세지 않음).
+    """
+    global _file_cache_chars
+    st = os.stat(path)
+    cached = _FILE_CACHE.get(path)
+    if cached is not None and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        return cached[2], cached[3]
+
+    with open(path, encoding="utf-8", errors="replace") as f:
+        text = f.read()
+    line_starts: List[int] = [0] if text else []
+    line_starts.extend(m.end() for m in _LINE_SEP_RE.finditer(text) if m.end() < len(text))
+
+    with _CACHE_LOCK:
+        old = _FILE_CACHE.pop(path, None)
+        if old is not None:
+            _file_cache_chars -= len(old[2])
+        if len(text) <= _FILE_CACHE_MAX_CHARS:
+            # 가장 먼저 들어온 항목부터 버림 (FIFO)
+            while _FILE_CACHE and (
+                len(_FILE_CACHE) >= _FILE_CACHE_MAX or _file_cache_chars + len(text) > _FILE_CACHE_MAX_CHARS
+            ):
+                _file_cache_chars -= len(_FILE_CACHE.pop(next(iter(_FILE_CACHE)))[2])
+            _FILE_CACHE[path] = (st.st_mtime_ns, st.st_size, text, line_starts)
+            _file_cache_chars += len(text)
+    return text, line_starts
+
+
+def _line_end(text: str, line_starts: List[int], idx: int) -> int:
+    """idx번째(0부터) 줄의 끝 오프셋 (개행 문자 제외)."""
+    if idx + 1 < len(line_starts):
+        return line_starts[idx + 1] - 1
+    return len(text) - 1 if text and text[-1] in _LINE_SEPS else len(text)
+
+
+@functools.lru_cache(maxsize=256)
+def _get_compiled(pattern: str, flags: int, regex_mode: bool) -> re.Pattern:
+    """
+    검색 패턴 컴파일 결과를 재사용 (문자열 검색은 re.escape로 정규식화).
+    """
+    return re.compile(pattern if regex_mode else re.escape(pattern), flags)
+
+
+@functools.lru_cache(maxsize=256)
+def _needs_line_slices(pattern: str) -> bool:
+    """
+    정규식에 앞뒤 문맥을 보는 문법(^, $, \\A, \\Z, lookahead/lookbehind)이 있는지 확인.
+    이런 패턴은 파일 전체에 돌리면 줄마다 돌릴 때와 결과가 달라짐
+    (예: \\A는 파일 첫 줄에서만 맞고, (?=\\n)은 다음 줄을 봄).
+    문자 클래스 안의 ^/$와 이스케이프된 문자는 건너뜀.
+    """
+    i = 0
+    in_class = False
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "\\":
+            if not in_class and pattern[i + 1 : i + 2] in ("A", "Z"):
+                return True
+            i += 2
+            continue
+        if in_class:
+            if c == "]":
+                in_class = False
+        elif c == "[":
+            in_class = True
+            # 맨 앞의 ^(부정)와 ]는 클래스 안의 문자
+            i += 1
+            if pattern[i : i + 1] == "^":
+                i += 1
+            if pattern[i : i + 1] == "]":
+                i += 1
+            continue
+        elif c in "^$" or pattern.startswith(("(?=", "(?!", "(?<=", "(?<!"), i):
+            return True
+        i += 1
+    return False
+
+
+def _match_lines(text: str, line_starts: List[int], compiled: re.Pattern) -> Iterable[int]:
+    """
+    파일 전체에 정규식을 한 번에 돌려서 매치가 있는 줄 번호(1부터)를 순서대로 반환.
+    줄마다 파이썬 루프를 돌지 않고, 매치 위치에서 bisect로 줄 번호를 구함.
+    한 줄에 여러 번 맞아도 한 번만 반환하고, 여러 줄에 걸친 매치는 그 줄 안에서 다시 확인.
+    앞뒤 문맥을 보는 패턴(_needs_line_slices)은 결과가 같도록 줄마다 잘라서 검사.
+    """
+    if _needs_line_slices(compiled.pattern):
+        for idx, start in enumerate(line_starts):
+            if compiled.search(text[start : _line_end(text, line_starts, idx)]) is not None:
+                yield idx + 1
+        return
+
+    pos = 0
+    while line_starts:
+        m = compiled.search(text, pos)
+        if m is None:
+            return
+        idx = bisect_right(line_starts, m.start()) - 1
+        end = _line_end(text, line_starts, idx)
+        if m.start() > end:
+            # 마지막 개행 뒤의 빈 위치에서만 맞은 경우
+            return
+        if m.end() <= end or compiled.search(text, line_starts[idx], end) is not None:
+            yield idx + 1
+        if idx + 1 >= len(line_starts):
+            return
+        pos = line_starts[idx + 1]
+
+
+def _find_lines(text: str, line_starts: List[int], needle: str) -> Iterable[int]:
+    """
+    대소문자 구분 + 문자열 포함 검색 전용. 정규식 엔진 없이 str.find(C 구현)로 바로 스캔.
+    """
+    if _LINE_SEP_RE.search(needle):
+        # 줄 단위 검색이라 줄 경계 문자가 들어간 문자열은 어느 줄에도 맞을 수 없음
+        return
+    pos = 0
+    while line_starts:
+        j = text.find(needle, pos)
+        if j < 0:
+            return
+        idx = bisect_right(line_starts, j) - 1
+        if j > _line_end(text, line_starts, idx):
+            return
+        yield idx + 1
+        if idx + 1 >= len(line_starts):
+            return
+        pos = line_starts[idx + 1]
+
+
+def _walk_allowed(root: str) -> List[str]:
+    """
+    os.scandir 기반 DFS로 허용 확장자 파일 경로를 모음.
+    DirEntry.is_dir/is_file은 디렉터리를 읽을 때 받은 타입 정보를 써서 항목마다 stat을 하지 않음.
+    심볼릭 링크는 따라가지 않음.
+    """
+    files: List[str] = []
+    stack = [root]
+    while stack:
+        d = stack.pop()
+        try:
+            with os.scandir(d) as it:
+                for e in it:
+                    if e.is_dir(follow_symlinks=False):
+                        stack.append(e.path)
+                    elif e.is_file(follow_symlinks=False):
+                        if os.path.splitext(e.name)[1].lower() in ALLOWED_EXTS:
+                            files.append(e.path)
+        except OSError:
+            # 권한 없는 폴더 등은 건너뜀
+            continue
+    return files
+
+
+def _iter_files(root: Path) -> List[str]:
+    """
+    root 아래의 허용 확장자 파일 전체 목록. 짧은 시간 안의 반복 호출은 캐시로 처리.
+    """
+    key = str(root)
+    mtime = root.stat().st_mtime_ns
+    now = time.monotonic()
+    cached = _LIST_CACHE.get(key)
+    if cached is not None and cached[0] == mtime and now - cached[1] < _LIST_CACHE_TTL:
+        return cached[2]
+
+    # 경로순으로 정렬해 두면 검색 결과와 list_files 순서가 매번 같음
+    files = sorted(_walk_allowed(key))
+    _LIST_CACHE[key] = (mtime, now, files)
+    return files
+
+
+def _snippet(
+    text: str,
+    line_starts: List[int],
+    i: int,
+    context_lines: int,
+    formatted: Optional[Dict[int, str]] = None,
+) -> str:
+    """
+    i번째 줄(1부터)과 주변 context_lines 줄을 "> 줄번호: 내용" 형태로 묶음.
+    formatted: 같은 파일의 히트끼리 공유하는 "줄번호 -> 포맷된 줄" 캐시.
+    인접한 히트의 문맥 창이 겹쳐도 각 줄은 한 번만 잘라서 포맷함.
+    """
+    if formatted is None:
+        formatted = {}
+    start = max(1, i - context_lines)
+    end = min(len(line_starts), i + context_lines)
+    for ln in range(start, end + 1):
+        if ln not in formatted:
+            line = text[line_starts[ln - 1] : _line_end(text, line_starts, ln - 1)]
+            formatted[ln] = f" {ln:>4}: {line}"
+    window = [formatted[ln] for ln in range(start, end + 1)]
+    window[i - start] = ">" + window[i - start][1:]
+    return "\n".join(window)
+
+
+def _rg_files(root: Path, pattern: str, case_sensitive: bool) -> Optional[FrozenSet[str]]:
+    """
+    ripgrep으로 문자열 포함 검색을 돌려 매치가 있는 파일 경로만 모음.
+    줄 번호는 rg(\\n 기준)와 파이썬(splitlines 기준)이 다를 수 있어서 파일 선별에만 씀.
+    rg가 제대로 끝나지 않으면 None (호출한 쪽에서 전체 파일을 스캔).
+    """
+    assert _RG is not None
+    cmd = [
+        _RG,
+        "--files-with-matches",
+        "--null",
+        "--fixed-strings",
+        "--case-sensitive" if case_sensitive else "--ignore-case",
+        "--no-ignore",
+        "--hidden",
+        "--text",
+    ]
+    for ext in sorted(ALLOWED_EXTS):
+        cmd += ["--iglob", f"*{ext}"]
+    cmd += ["--", pattern, str(root)]
+
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    if proc.returncode not in (0, 1):
+        # 읽을 수 없는 파일이 있거나 rg 자체가 실패한 경우
+        return None
+    return frozenset(os.fsdecode(p) for p in proc.stdout.split(b"\0") if p)
+
+
+def _group_hits(hits: List[SearchHit]) -> List[Dict[str, Any]]:
+    """
+    hit 목록을 파일별로 묶음: [{"path": ..., "hits": [{"line_no": ..., "snippet": ...}, ...]}, ...]
+    같은 경로 문자열이 hit마다 반복되지 않아서 LLM에 넘기는 토큰이 줄어듦.
+    파일 순서는 처음 등장한 순서를 유지.
+    """
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for hit in hits:
+        groups.setdefault(hit.path, []).append({"line_no": hit.line_no, "snippet": hit.line})
+    return [{"path": path, "hits": file_hits} for path, file_hits in groups.items()]
+
+
+def _scan_file(
+    path: str,
+    pattern: str,
+    compiled: Optional[re.Pattern],
+    context_lines: int,
+    max_hits: int,
+) -> List[SearchHit]:
+    """
+    파일 하나를 검색해서 hit 목록을 반환. 최대 max_hits개.
+    """
+    try:
+        text, line_starts = _get_text(path)
+    except Exception:
+        return []
+
+    if compiled is None:
+        matched_lines = _find_lines(text, line_starts, pattern)
+    else:
+        matched_lines = _match_lines(text, line_starts, compiled)
+
+    hits: List[SearchHit] = []
+    formatted: Dict[int, str] = {}
+    for i in matched_lines:
+        # 주변 문맥 붙여주기(간단) - 필요한 줄만 잘라냄
+        hits.append(SearchHit(path=path, line_no=i, line=_snippet(text, line_starts, i, context_lines, formatted)))
+        if len(hits) >= max_hits:
+            break
+    return hits
+
+
+def _read_prefix(p: Path, max_chars: int) -> str:
+    """
+    파일 앞부분 max_chars 글자만 디코딩해서 반환 (read_text와 같은 개행 처리).
+    UTF-8은 한 글자가 최대 4바이트라 앞쪽 max_chars*4 바이트만 보면 충분함.
+    큰 로그 파일도 전체를 읽지 않고 mmap으로 필요한 부분만 잘라냄.
+    잘린 끝의 미완성 UTF-8 시퀀스는 incremental decoder가 보류하므로 앞부분은 전체 디코딩과 같은 결과.
+    """
+    limit = max_chars * 4
+    with open(p, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size <= limit:
+            text = f.read().decode("utf-8", errors="replace")
+            cut_file = False
+        else:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+                text = decoder.decode(mm[:limit], final=False)
+            cut_file = True
+
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    if cut_file or len(text) > max_chars:
+        return text[:max_chars] + "\n\n...[TRUNCATED]..."
+    return text
 
 
 def list_files(root_dir: str, max_files: int = 200) -> List[str]:
     """
     root_dir 아래의 허용 확장자 파일 목록을 반환.
     """
-    root = Path(root_dir).expanduser().resolve()
+    root = Path(_resolved_root(root_dir))
     if not root.exists() or not root.is_dir():
         raise ToolError(f"root_dir not found or not a directory: {root}")
 
-    results: List[str] = []
-    for p in root.rglob("*"):
-        if p.is_file() and p.suffix.lower() in ALLOWED_EXTS:
-            results.append(str(p))
-            if len(results) >= max_files:
-                break
-
-    return results
+    return _iter_files(root)[:max_files]
 
 
 def read_file(root_dir: str, path: str, max_chars: int = 12_000) -> str:
@@ -73,10 +395,7 @@ def read_file(root_dir: str, path: str, max_chars: int = 12_000) -> str:
     if not p.exists() or not p.is_file():
         raise ToolError(f"File not found: {p}")
 
-    text = p.read_text(encoding="utf-8", errors="replace")
-    if len(text) > max_chars:
-        return text[:max_chars] + "\n\n...[TRUNCATED]..."
-    return text
+    return _read_prefix(p, max_chars)
 
 
 def search_files(
@@ -85,16 +404,22 @@ def search_files(
     max_hits: int = 25,
     context_lines: int = 1,
     case_sensitive: bool = False,
-) -> List[SearchHit]:
+    max_files: Optional[int] = None,
+) -> List[Dict[str, Any]]:
     """
     root_dir 내 파일들에서 query 문자열(또는 정규식)을 검색.
     - 기본은 '문자열 포함' 검색
     - query가 /.../ 형태면 정규식으로 처리
+    - max_files를 주면 파일 목록의 앞쪽 max_files개만 검색
+    - 결과는 파일별로 묶어서 반환 (_group_hits 참고)
     """
-    root = Path(root_dir).expanduser().resolve()
+    root = Path(_resolved_root(root_dir))
     if not root.exists() or not root.is_dir():
         raise ToolError(f"root_dir not found or not a directory: {root}")
 
+    # 음수면 _snippet의 문맥 창이 비므로 0으로 맞춤 (hit 줄만 표시)
+    context_lines = max(0, context_lines)
+
     # 정규식 모드 지원: /pattern/
     regex_mode = False
     pattern = query
@@ -102,48 +427,32 @@ def search_files(
         regex_mode = True
         pattern = query[1:-1]
 
+    paths = _iter_files(root)
+    if max_files is not None:
+        paths = paths[:max_files]
+
+    if _RG is not None and not regex_mode and not _LINE_SEP_RE.search(pattern):
+        # 정규식 문법은 파이썬 re와 rg가 달라서 문자열 포함 검색만 rg로 처리
+        # rg로 매치가 있는 파일만 골라내고, 줄 번호/스니펫은 아래 파이썬 스캔으로 계산 (rg가 없을 때와 결과가 같음)
+        matched = _rg_files(root, pattern, case_sensitive)
+        if matched is not None:
+            paths = [p for p in paths if p in matched]
+
+    hits: List[SearchHit] = []
+
+    # 대소문자 구분 문자열 검색은 str.find로, 나머지는 정규식으로 파일 전체를 한 번에 스캔
     flags = 0 if case_sensitive else re.IGNORECASE
     compiled: Optional[re.Pattern] = None
-    if regex_mode:
+    if regex_mode or not case_sensitive:
         try:
-            compiled = re.compile(pattern, flags)
+            compiled = _get_compiled(pattern, flags, regex_mode)
         except re.error as e:
             raise ToolError(f"Invalid regex: {e}")
 
-    hits: List[SearchHit] = []
-
-    for p in root.rglob("*"):
-        if not (p.is_file() and p.suffix.lower() in ALLOWED_EXTS):
-            continue
-
-        try:
-            lines = p.read_text(encoding="utf-8", errors="replace").splitlines()
-        except Exception:
-            continue
-
-        for i, line in enumerate(lines, start=1):
-            matched = False
-            if regex_mode:
-                assert compiled is not None
-                matched = compiled.search(line) is not None
-            else:
-                if case_sensitive:
-                    matched = query in line
-                else:
-                    matched = query.lower() in line.lower()
-
-            if matched:
-                # 주변 문맥 붙여주기(간단)
-                start = max(1, i - context_lines)
-                end = min(len(lines), i + context_lines)
-                snippet = []
-                for ln in range(start, end + 1):
-                    prefix = ">" if ln == i else " "
-                    snippet.append(f"{prefix}{ln:>4}: {lines[ln-1]}")
-                joined = "\n".join(snippet)
-
-                hits.append(SearchHit(path=str(p), line_no=i, line=joined))
-                if len(hits) >= max_hits:
-                    return hits
-
-    return hits
+    # 경로순으로 한 파일씩 스캔하다가 max_hits를 채우면 바로 멈춤 (결과가 항상 같음)
+    # 파일별 작업은 GIL을 잡고 도는 디코딩/스캔이 대부분이라 스레드로 나눠도 빨라지지 않음
+    for path in paths:
+        hits.extend(_scan_file(path, pattern, compiled, context_lines, max_hits - len(hits)))
+        if len(hits) >= max_hits:
+            break
+    return _group_hits(hits)